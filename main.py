@@ -1,10 +1,16 @@
 import os
+import sys
 import time
 import asyncio
 import httpx
+import orjson
+import msgpack
 import csv
-from datetime import datetime
-import pytz
+import numpy as np
+from numba import njit
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 # ================================
 # ENV CONFIG
@@ -14,8 +20,10 @@ API_KEY = os.getenv("TWELVEDATA_API_KEY")
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
-SYMBOLS = os.getenv("SYMBOLS", "BTC/USD").split(",")
-TIMEFRAMES = os.getenv("TIMEFRAMES", "5min,15min").split(",")
+SYMBOLS = [sys.intern(s) for s in os.getenv("SYMBOLS", "BTC/USD").split(",")]
+TIMEFRAMES = [sys.intern(t) for t in os.getenv("TIMEFRAMES", "5min,15min").split(",")]
+
+SAFE_SYMBOLS = {s: s.replace("/", "_").replace(":", "_") for s in SYMBOLS}
 
 RSI_PERIOD = 14
 RSI_UPPER = float(os.getenv("RSI_UPPER", 60))
@@ -23,149 +31,365 @@ RSI_LOWER = float(os.getenv("RSI_LOWER", 40))
 
 CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", 60))
 
-IST = pytz.timezone("Asia/Kolkata")
+IST = ZoneInfo("Asia/Kolkata")
 
 # ================================
 # GLOBAL STATE
 # ================================
 
-last_alert_state = {}
-telegram_cache = {}
-api_rate_remaining = "N/A"
+last_alert_state = {}  # (symbol, timeframe) -> "above" | "below" | "neutral"
+rsi_state = {}  # (symbol, timeframe) -> (avg_gain, avg_loss, last_close)
+last_bar_time = {}  # (symbol, timeframe) -> newest bar datetime seen
+last_result = {}    # (symbol, timeframe) -> (rsi, price) for that bar
+telegram_cache = OrderedDict()  # message -> monotonic timestamp, LRU-bounded
+TELEGRAM_CACHE_MAX = 512
+TELEGRAM_FLUSH_INTERVAL = 3  # seconds between batched sends
+TELEGRAM_MAX_LEN = 4000      # Telegram message size limit
+telegram_queue = []
+api_rate_remaining = None  # parsed from X-RateLimit-Remaining, None when unknown
 rate_limit_warning_sent = False
 api_total_hits = 0
 csv_sent_today = False
 
-client = httpx.AsyncClient(timeout=15)
+# ================================
+# ALERT TEMPLATES
+# ================================
+
+ABOVE_TMPL = (
+    f"📈 RSI CROSS ABOVE {RSI_UPPER}\n"
+    "Symbol: {symbol}\n"
+    "Timeframe: {timeframe}\n"
+    "RSI: {rsi}\n"
+    "Price: {price}\n"
+    "API Used: {hits}\n"
+    "API Remaining: {remaining}"
+)
+
+BELOW_TMPL = (
+    f"📉 RSI CROSS BELOW {RSI_LOWER}\n"
+    "Symbol: {symbol}\n"
+    "Timeframe: {timeframe}\n"
+    "RSI: {rsi}\n"
+    "Price: {price}\n"
+    "API Used: {hits}\n"
+    "API Remaining: {remaining}"
+)
+
+# Indexed by (rsi > RSI_UPPER) - (rsi < RSI_LOWER) + 1
+STATES = ("below", "neutral", "above")
+
+ALERT_TMPL = {"above": ABOVE_TMPL, "below": BELOW_TMPL}
+ALERT_DIRECTION = {"above": "ABOVE", "below": "BELOW"}
 
 # ================================
 # RSI CALCULATION (Wilder)
 # ================================
 
-def calculate_rsi(closes, period=14):
+def rsi_from_averages(avg_gain, avg_loss):
+    if avg_loss == 0:
+        return 100
+
+    rs = avg_gain / avg_loss
+    rsi = 100 - (100 / (1 + rs))
+
+    return round(rsi, 2)
+
+
+@njit(cache=True)
+def _wilder_tail(avg_gain, avg_loss, diffs, period):
+    for d in diffs:
+        gain = d if d > 0 else 0.0
+        loss = -d if d < 0 else 0.0
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+    return avg_gain, avg_loss
+
+
+# Warm up the JIT so the first real seed doesn't pay compilation time
+_wilder_tail(0.0, 0.0, np.zeros(1), 14)
+
+
+def seed_rsi(key, closes, period=14):
+    """Full Wilder pass over history, caching the averages for incremental updates."""
     if len(closes) < period + 1:
         return None
 
-    gains = []
-    losses = []
+    closes = np.asarray(closes, dtype=np.float64)
+    diffs = np.diff(closes)
 
-    for i in range(1, period + 1):
-        change = closes[i] - closes[i - 1]
-        if change >= 0:
-            gains.append(change)
-            losses.append(0)
-        else:
-            gains.append(0)
-            losses.append(abs(change))
+    avg_gain = np.clip(diffs[:period], 0, None).mean()
+    avg_loss = np.clip(-diffs[:period], 0, None).mean()
 
-    avg_gain = sum(gains) / period
-    avg_loss = sum(losses) / period
+    avg_gain, avg_loss = _wilder_tail(avg_gain, avg_loss, diffs[period:], period)
 
-    for i in range(period + 1, len(closes)):
-        change = closes[i] - closes[i - 1]
-        gain = max(change, 0)
-        loss = max(-change, 0)
+    rsi_state[key] = (avg_gain, avg_loss, closes[-1])
 
-        avg_gain = ((avg_gain * (period - 1)) + gain) / period
-        avg_loss = ((avg_loss * (period - 1)) + loss) / period
+    return rsi_from_averages(avg_gain, avg_loss)
 
-    if avg_loss == 0:
-        return 100
 
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
+def update_rsi(key, close, period=14):
+    """One Wilder recurrence step from the cached averages — O(1) per new close."""
+    avg_gain, avg_loss, last_close = rsi_state[key]
 
-    return round(rsi, 2)
+    change = close - last_close
+    gain = max(change, 0)
+    loss = max(-change, 0)
+
+    avg_gain = ((avg_gain * (period - 1)) + gain) / period
+    avg_loss = ((avg_loss * (period - 1)) + loss) / period
+
+    rsi_state[key] = (avg_gain, avg_loss, close)
+
+    return rsi_from_averages(avg_gain, avg_loss)
 
 # ================================
 # TELEGRAM SAFE SEND
 # ================================
 
 async def send_telegram(message, cooldown=30):
-    try:
-        now = time.time()
-        if message in telegram_cache:
-            if now - telegram_cache[message] < cooldown:
-                return
+    now = time.monotonic()
+    ts = telegram_cache.get(message)
+    if ts is not None and now - ts < cooldown:
+        return
+
+    telegram_cache[message] = now
+    telegram_cache.move_to_end(message)
+    while len(telegram_cache) > TELEGRAM_CACHE_MAX:
+        telegram_cache.popitem(last=False)
+
+    telegram_queue.append(message)
+
 
+async def post_telegram(client, text):
+    try:
         url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
 
         await client.post(
             url,
-            json={"chat_id": CHAT_ID, "text": message}
+            json={"chat_id": CHAT_ID, "text": text}
         )
 
-        telegram_cache[message] = now
-
     except Exception as e:
         print("Telegram Error:", e)
 
+
+async def telegram_flusher(client):
+    """Drain queued alerts every few seconds into combined messages."""
+    while True:
+        await asyncio.sleep(TELEGRAM_FLUSH_INTERVAL)
+
+        if not telegram_queue:
+            continue
+
+        pending = telegram_queue[:]
+        telegram_queue.clear()
+
+        batch = ""
+        for message in pending:
+            combined = message if not batch else batch + "\n---\n" + message
+
+            if batch and len(combined) > TELEGRAM_MAX_LEN:
+                await post_telegram(client, batch)
+                batch = message
+            else:
+                batch = combined
+
+        if batch:
+            await post_telegram(client, batch)
+
 # ================================
 # CSV LOGGER
 # ================================
 
-def log_csv(symbol, timeframe, rsi, price, direction):
+csv_handles = {}  # filename -> (file, writer), kept open and flushed periodically
+CSV_FLUSH_INTERVAL = 30
+
+
+def log_csv(symbol, timeframe, rsi, price, direction, now_ist, today):
     try:
-        now = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
-        safe_symbol = symbol.replace("/", "_").replace(":", "_")
-        filename = f"{safe_symbol}_{datetime.now(IST).date()}.csv"
-        file_exists = os.path.isfile(filename)
+        now = now_ist.strftime("%Y-%m-%d %H:%M:%S")
+        filename = f"{SAFE_SYMBOLS[symbol]}_{today}.csv"
 
-        with open(filename, "a", newline="") as f:
+        handle = csv_handles.get(filename)
+
+        if handle is None:
+            file_exists = os.path.isfile(filename)
+            f = open(filename, "a", newline="", buffering=8192)
             writer = csv.writer(f)
             if not file_exists:
                 writer.writerow(
                     ["DateTime", "Symbol", "Timeframe", "RSI", "Price", "Direction"]
                 )
-            writer.writerow([now, symbol, timeframe, rsi, price, direction])
+            csv_handles[filename] = (f, writer)
+        else:
+            f, writer = handle
+
+        writer.writerow([now, symbol, timeframe, rsi, price, direction])
 
     except Exception as e:
         print("CSV Error:", e)
 
+
+def flush_csv_handles():
+    for f, _ in csv_handles.values():
+        try:
+            f.flush()
+        except Exception as e:
+            print("CSV Flush Error:", e)
+
+
+def close_csv_handles():
+    for f, _ in csv_handles.values():
+        try:
+            f.close()
+        except Exception as e:
+            print("CSV Close Error:", e)
+    csv_handles.clear()
+
+
+async def csv_flusher():
+    while True:
+        await asyncio.sleep(CSV_FLUSH_INTERVAL)
+        await asyncio.to_thread(flush_csv_handles)
+
+# ================================
+# STATE SNAPSHOT
+# ================================
+
+STATE_FILE = "state.msgpack"
+
+
+def write_state():
+    try:
+        payload = {
+            "rsi_state": [
+                [s, tf, ag, al, lc]
+                for (s, tf), (ag, al, lc) in rsi_state.items()
+            ],
+            "last_alert_state": [
+                [s, tf, st]
+                for (s, tf), st in last_alert_state.items()
+            ],
+        }
+
+        with open(STATE_FILE, "wb") as f:
+            f.write(msgpack.packb(payload, default=float))
+
+    except Exception as e:
+        print("State Save Error:", e)
+
+
+def load_state():
+    if not os.path.isfile(STATE_FILE):
+        return
+
+    try:
+        with open(STATE_FILE, "rb") as f:
+            payload = msgpack.unpackb(f.read())
+
+        for s, tf, ag, al, lc in payload.get("rsi_state", []):
+            rsi_state[(sys.intern(s), sys.intern(tf))] = (ag, al, lc)
+
+        for s, tf, st in payload.get("last_alert_state", []):
+            last_alert_state[(sys.intern(s), sys.intern(tf))] = st
+
+        print("State Loaded:", STATE_FILE)
+
+    except Exception as e:
+        print("State Load Error:", e)
+
 # ================================
 # FETCH DATA
 # ================================
 
-async def fetch_data(symbol, timeframe):
+async def fetch_data(client, timeframe):
+    """One batched time_series request covering all SYMBOLS for this timeframe."""
 
     global api_rate_remaining, api_total_hits
 
     try:
         url = "https://api.twelvedata.com/time_series"
 
+        seeded_all = all((s, timeframe) in rsi_state for s in SYMBOLS)
+
         params = {
-            "symbol": symbol,
+            "symbol": ",".join(SYMBOLS),
             "interval": timeframe,
-            "outputsize": 100,
+            "outputsize": 1 if seeded_all else 100,
             "apikey": API_KEY
         }
 
         r = await client.get(url, params=params)
 
         api_total_hits += 1
-        api_rate_remaining = r.headers.get("X-RateLimit-Remaining", "N/A")
+        try:
+            api_rate_remaining = int(r.headers["X-RateLimit-Remaining"])
+        except (KeyError, ValueError):
+            pass
+
+        data = orjson.loads(r.content)
+
+        results = {}
+
+        for symbol in SYMBOLS:
 
-        data = r.json()
+            # Single-symbol responses are flat, batched ones are keyed by symbol
+            payload = data if len(SYMBOLS) == 1 else data.get(symbol, {})
 
-        if "values" not in data:
-            print("TimeSeries Error:", data)
-            return None, None
+            if "values" not in payload:
+                print("TimeSeries Error:", symbol, payload)
+                results[symbol] = (None, None)
+                continue
 
-        closes = [float(x["close"]) for x in reversed(data["values"])]
-        price = closes[-1]
+            key = (symbol, timeframe)
 
-        rsi = calculate_rsi(closes, RSI_PERIOD)
+            # Same candle as last poll -> nothing can have changed; reuse
+            # the cached result and leave the Wilder averages untouched.
+            bar_time = payload["values"][0]["datetime"]
+            if bar_time == last_bar_time.get(key):
+                results[symbol] = last_result[key]
+                continue
 
-        return rsi, price
+            if key in rsi_state:
+                price = float(payload["values"][0]["close"])
+                rsi = update_rsi(key, price, RSI_PERIOD)
+            else:
+                values = payload["values"]
+                # [::-1] is a view, so oldest-first order costs no copy
+                closes = np.fromiter(
+                    (float(x["close"]) for x in values),
+                    dtype=np.float64,
+                    count=len(values)
+                )[::-1]
+                price = float(closes[-1])
+                rsi = seed_rsi(key, closes, RSI_PERIOD)
+
+            last_bar_time[key] = bar_time
+            last_result[key] = (rsi, price)
+            results[symbol] = (rsi, price)
+
+        return results
 
     except Exception as e:
         print("Fetch Error:", e)
-        return None, None
+        return {symbol: (None, None) for symbol in SYMBOLS}
 
 # ================================
 # MAIN LOOP
 # ================================
 
+def next_close_seconds(timeframe, now):
+    """Seconds until just after this timeframe's next candle close."""
+    if not timeframe.endswith("min"):
+        return CHECK_INTERVAL
+
+    step = int(timeframe[:-3])
+    minutes = (step - now.minute % step) % step or step
+    target = (now + timedelta(minutes=minutes)).replace(second=1, microsecond=0)
+
+    return max((target - now).total_seconds(), 1)
+
+
 async def bot_loop():
 
     global rate_limit_warning_sent, csv_sent_today
@@ -175,125 +399,159 @@ async def bot_loop():
     print("TIMEFRAMES:", TIMEFRAMES)
     print("CHECK_INTERVAL:", CHECK_INTERVAL)
 
-    while True:
-        try:
-            now = datetime.now(IST)
-            current_hour = now.hour
-            minute = now.minute
-
-            # ==========================
-            # SEND DAILY CSV AT 11PM
-            # ==========================
-
-            if current_hour == 23 and minute == 0 and not csv_sent_today:
-
-                for symbol in SYMBOLS:
-                    safe_symbol = symbol.replace("/", "_").replace(":", "_")
-                    filename = f"{safe_symbol}_{now.date()}.csv"
-
-                    if os.path.isfile(filename):
-                        try:
-                            await client.post(
-                                f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument",
-                                data={"chat_id": CHAT_ID},
-                                files={"document": open(filename, "rb")}
-                            )
-                            print("CSV Sent:", filename)
-                        except Exception as e:
-                            print("CSV Send Error:", e)
+    load_state()
 
-                csv_sent_today = True
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(15.0, connect=5.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=32,
+            max_connections=64,
+            keepalive_expiry=60.0
+        )
+    ) as client:
 
-            # Reset next day
-            if current_hour == 0 and minute == 1:
-                csv_sent_today = False
+        asyncio.create_task(telegram_flusher(client))
+        asyncio.create_task(csv_flusher())
 
-            # ==========================
-            # RUN ONLY 5AM–11PM
-            # ==========================
+        while True:
+            try:
+                now = datetime.now(IST)
+                today = now.date()
+                current_hour = now.hour
+                minute = now.minute
 
-            if current_hour < 5 or current_hour > 23:
-                await asyncio.sleep(60)
-                continue
+                # ==========================
+                # SEND DAILY CSV AT 11PM
+                # ==========================
 
-            for timeframe in TIMEFRAMES:
+                if current_hour == 23 and minute == 0 and not csv_sent_today:
 
-                if timeframe == "5min" and minute % 5 != 0:
-                    continue
+                    flush_csv_handles()
+
+                    for symbol in SYMBOLS:
+                        filename = f"{SAFE_SYMBOLS[symbol]}_{today}.csv"
+
+                        if os.path.isfile(filename):
+                            try:
+                                await client.post(
+                                    f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument",
+                                    data={"chat_id": CHAT_ID},
+                                    files={"document": open(filename, "rb")}
+                                )
+                                print("CSV Sent:", filename)
+                            except Exception as e:
+                                print("CSV Send Error:", e)
+
+                    csv_sent_today = True
 
-                if timeframe == "15min" and minute % 15 != 0:
+                # Reset next day
+                if current_hour == 0 and minute == 1:
+                    csv_sent_today = False
+
+                # ==========================
+                # RUN ONLY 5AM–11PM
+                # ==========================
+
+                if current_hour < 5 or current_hour > 23:
+                    await asyncio.sleep(60)
                     continue
 
-                for symbol in SYMBOLS:
+                due_timeframes = [
+                    tf for tf in TIMEFRAMES
+                    if not (tf == "5min" and minute % 5 != 0)
+                    and not (tf == "15min" and minute % 15 != 0)
+                ]
+
+                batches = await asyncio.gather(
+                    *[fetch_data(client, tf) for tf in due_timeframes],
+                    return_exceptions=True
+                )
 
-                    rsi, price = await fetch_data(symbol, timeframe)
+                for timeframe, results in zip(due_timeframes, batches):
 
-                    if rsi is None:
+                    if isinstance(results, Exception):
+                        print("Fetch Error:", timeframe, results)
                         continue
 
-                    key = f"{symbol}_{timeframe}"
-                    prev_state = last_alert_state.get(key, "neutral")
+                    for symbol in SYMBOLS:
+
+                        rsi, price = results[symbol]
+
+                        if rsi is None:
+                            continue
+
+                        key = (symbol, timeframe)
+                        prev_state = last_alert_state.get(key, "neutral")
 
-                    # Rate limit warning
-                    try:
-                        remaining = int(api_rate_remaining)
-                        if remaining < 20 and not rate_limit_warning_sent:
+                        # Rate limit warning
+                        if (
+                            api_rate_remaining is not None
+                            and api_rate_remaining < 20
+                            and not rate_limit_warning_sent
+                        ):
                             await send_telegram(
-                                f"⚠️ API Remaining Low → {remaining}\n"
+                                f"⚠️ API Remaining Low → {api_rate_remaining}\n"
                                 f"Total Used: {api_total_hits}"
                             )
                             rate_limit_warning_sent = True
-                    except:
-                        pass
-
-                    # ==========================
-                    # TRUE CROSSOVER LOGIC
-                    # ==========================
-
-                    if rsi > RSI_UPPER and prev_state != "above":
-
-                        msg = (
-                            f"📈 RSI CROSS ABOVE {RSI_UPPER}\n"
-                            f"Symbol: {symbol}\n"
-                            f"Timeframe: {timeframe}\n"
-                            f"RSI: {rsi}\n"
-                            f"Price: {price}\n"
-                            f"API Used: {api_total_hits}\n"
-                            f"API Remaining: {api_rate_remaining}"
-                        )
-
-                        await send_telegram(msg)
-                        log_csv(symbol, timeframe, rsi, price, "ABOVE")
-                        last_alert_state[key] = "above"
-
-                    elif rsi < RSI_LOWER and prev_state != "below":
-
-                        msg = (
-                            f"📉 RSI CROSS BELOW {RSI_LOWER}\n"
-                            f"Symbol: {symbol}\n"
-                            f"Timeframe: {timeframe}\n"
-                            f"RSI: {rsi}\n"
-                            f"Price: {price}\n"
-                            f"API Used: {api_total_hits}\n"
-                            f"API Remaining: {api_rate_remaining}"
-                        )
-
-                        await send_telegram(msg)
-                        log_csv(symbol, timeframe, rsi, price, "BELOW")
-                        last_alert_state[key] = "below"
-
-                    elif RSI_LOWER < rsi < RSI_UPPER:
-                        last_alert_state[key] = "neutral"
-
-            await asyncio.sleep(CHECK_INTERVAL)
 
-        except Exception as e:
-            print("Main Loop Error:", e)
-            await asyncio.sleep(5)
+                        # ==========================
+                        # TRUE CROSSOVER LOGIC
+                        # ==========================
+
+                        new_state = STATES[
+                            (rsi > RSI_UPPER) - (rsi < RSI_LOWER) + 1
+                        ]
+
+                        if new_state != prev_state:
+
+                            if new_state != "neutral":
+
+                                msg = ALERT_TMPL[new_state].format(
+                                    symbol=symbol,
+                                    timeframe=timeframe,
+                                    rsi=rsi,
+                                    price=price,
+                                    hits=api_total_hits,
+                                    remaining=(
+                                        api_rate_remaining
+                                        if api_rate_remaining is not None
+                                        else "N/A"
+                                    )
+                                )
+
+                                await send_telegram(msg)
+                                await asyncio.to_thread(
+                                    log_csv, symbol, timeframe, rsi, price,
+                                    ALERT_DIRECTION[new_state], now, today
+                                )
+
+                            last_alert_state[key] = new_state
+
+                await asyncio.to_thread(write_state)
+
+                now = datetime.now(IST)
+                await asyncio.sleep(
+                    min(next_close_seconds(tf, now) for tf in TIMEFRAMES)
+                )
+
+            except Exception as e:
+                print("Main Loop Error:", e)
+                await asyncio.sleep(5)
 
 # ================================
 # ENTRY
 # ================================
 
 if __name__ == "__main__":
-    asyncio.run(bot_loop())
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # e.g. Windows — fall back to the default loop
+
+    try:
+        asyncio.run(bot_loop())
+    finally:
+        close_csv_handles()